@@ -4,133 +4,300 @@ import asyncio
 import time
 import logging
 import orjson
-import hashlib 
-import uuid 
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from typing import List, Tuple
-from sqlalchemy import text
+import os
+import uuid
+import numpy as np
+from collections import deque
+from functools import lru_cache
+from blake3 import blake3
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from fastapi.responses import ORJSONResponse
+from typing import List, Optional, Tuple
 
-from app.models.schemas import ContextRequest, ContextResponse, ContextChunk
+from app.models.schemas import ContextRequest, ContextResponse
 from app.core.dependencies import get_api_key
 from app.core.config import settings
-from app.core.limiter import limiter
+from app.core.cache import CACHE_LEASE
+from app.core.limiter import rate_limit
+from app.core.routing import ORJSONRoute
 
-router = APIRouter()
+# Included routes keep their own route class, so it is set here rather than on api_router.
+router = APIRouter(route_class=ORJSONRoute)
 logger = logging.getLogger(__name__)
 
+def _query_vector_key(normalized_query: str) -> str:
+    """
+    Returns the Redis key for a cached query embedding.
+
+    Vectors are keyed on the model, distance metric (which decides normalization) and
+    normalized query text only, so they are reused even when `max_results` or
+    `filters` differ between requests.
+    """
+    key_material = f"{settings.EMBEDDING_MODEL_NAME}:{settings.VECTOR_DISTANCE_METRIC}:{normalized_query}"
+    vector_hash = blake3(key_material.encode()).hexdigest(length=16)
+    return f"qvec16:{vector_hash}"
+
+async def _store_cache_entries(redis_client, cache_writes: List[Tuple[str, bytes, int]], log_query_id: str) -> None:
+    """Writes (key, value, ttl) entries to Redis in a single pipelined round trip."""
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for key, value, ttl in cache_writes:
+                pipe.set(key, value, ex=ttl)
+            await pipe.execute()
+        logger.info(f"Stored {len(cache_writes)} new cache entries for {log_query_id}")
+    except Exception as e:
+        logger.error(f"Redis cache store failed for {log_query_id}: {e}", exc_info=True)
+
+_CACHE_LEASE_POLL_SECONDS = 0.025
+
+async def _wait_for_cached_result(redis_client, cache_key: str) -> Optional[bytes]:
+    """
+    Polls a leased cache key until its holder stores the result.
+
+    Returns None if the lease is released or not resolved within REDIS_CACHE_LEASE_WAIT_MS,
+    in which case the caller computes the result itself.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.REDIS_CACHE_LEASE_WAIT_MS / 1000.0
+    while loop.time() < deadline:
+        await asyncio.sleep(_CACHE_LEASE_POLL_SECONDS)
+        value = await redis_client.get(cache_key)
+        if value != CACHE_LEASE:
+            return value
+    return None
+
+async def _release_cache_lease(release_lease, cache_key: str, log_query_id: str) -> None:
+    try:
+        await release_lease(keys=[cache_key], args=[CACHE_LEASE])
+    except Exception as e:
+        logger.error(f"Redis cache lease release failed for {log_query_id}: {e}", exc_info=True)
+
+def _run_in_background(request: Request, coro) -> None:
+    # The task is tracked on app.state so it is not garbage-collected mid-flight.
+    bg_tasks = request.app.state.bg_tasks
+    task = asyncio.create_task(coro)
+    bg_tasks.add(task)
+    task.add_done_callback(bg_tasks.discard)
+
+# pgvector operator and distance-to-similarity expression per VECTOR_DISTANCE_METRIC.
+# `<#>` returns the *negative* inner product, which equals cosine similarity for unit vectors.
+_DISTANCE_SQL = {
+    "l2": ("<->", "1 - (embedding <-> $1)"),
+    "inner_product": ("<#>", "-(embedding <#> $1)"),
+}
+
+@lru_cache(maxsize=64)
+def _vector_search_sql(db_table_name: str, filter_count: int) -> str:
+    """
+    Returns the vector search SQL for a table and number of metadata filters.
+
+    Filter keys and values are both bound parameters, so neither can inject SQL, and
+    the text depends only on the filter count. It is built once per shape here and
+    then served from asyncpg's per-connection prepared statement cache.
+    """
+    # This creates clauses like "metadata->>$3 = $4"
+    where_clauses = [f"metadata->>${3 + 2 * i} = ${4 + 2 * i}" for i in range(filter_count)]
+    where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+
+    # Order by the bare distance operator so pgvector can answer from its ANN index.
+    operator, score_sql = _DISTANCE_SQL[settings.VECTOR_DISTANCE_METRIC]
+    return f"""
+        SELECT content, metadata, {score_sql} AS score
+        FROM {db_table_name}
+        {where_sql}
+        ORDER BY embedding {operator} $1
+        LIMIT $2
+    """
+
+_QUERY_ID_BATCH_SIZE = 1024
+_query_ids: deque = deque()
+
+def _next_query_id() -> bytes:
+    """
+    Returns a random (version 4) UUID string as ASCII bytes.
+
+    IDs are minted in batches from a single os.urandom call, so the urandom syscall
+    is paid once per _QUERY_ID_BATCH_SIZE responses instead of once per response.
+    """
+    if not _query_ids:
+        entropy = os.urandom(16 * _QUERY_ID_BATCH_SIZE)
+        _query_ids.extend(
+            str(uuid.UUID(bytes=entropy[i:i + 16], version=4)).encode()
+            for i in range(0, len(entropy), 16)
+        )
+    return _query_ids.popleft()
+
+def _client_cache_headers(etag: str) -> dict:
+    # Clients may reuse a response for as long as the server-side cache would serve it.
+    return {"ETag": etag, "Cache-Control": f"private, max-age={settings.REDIS_CACHE_TTL_SECONDS}"}
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match uses weak comparison: only the opaque tags are compared.
+    if not if_none_match:
+        return False
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") in (opaque_tag, "*") for tag in if_none_match.split(","))
+
+def _render_context_response(context_json: bytes, elapsed_ms: int, etag: str) -> Response:
+    """
+    Wraps an already-serialized `context` array in a ContextResponse body.
+
+    The same bytes are stored in and served from the Redis cache, so they are spliced
+    in verbatim instead of being decoded, re-validated and re-encoded.
+    """
+    body = b'{"query_id":"%s","context":%s,"processing_time_ms":%d}' % (
+        _next_query_id(), context_json, elapsed_ms
+    )
+    return Response(content=body, media_type="application/json", headers=_client_cache_headers(etag))
+
 @router.post(
     "/context",
-    response_model=ContextResponse,
+    response_class=ORJSONResponse,
     summary="Retrieve Codebase Context",
-    tags=["Core"]
+    tags=["Core"],
+    # Documented here rather than via response_model: the handler returns pre-serialized
+    # responses and must not be re-encoded by FastAPI.
+    responses={200: {"model": ContextResponse}},
+    dependencies=[Depends(rate_limit)],
 )
-@limiter.limit(settings.RATE_LIMIT_TIMEFRAME)
 async def get_context(request: Request, body: ContextRequest, api_key: str = Depends(get_api_key)):
     """
     Retrieves relevant context chunks for a given query from PostgreSQL.
     """
-    start_time = time.monotonic()
+    start_ns = time.perf_counter_ns()
     
     normalized_query = body.query.lower().strip()
-    cache_key_parts = [normalized_query, str(body.max_results)]
+    cache_key_parts = [normalized_query.encode(), str(body.max_results).encode()]
     if body.filters:
-        sorted_filters = orjson.dumps(body.filters, option=orjson.OPT_SORT_KEYS).decode()
-        cache_key_parts.append(sorted_filters)
+        # orjson emits bytes; hash them directly rather than round-tripping through str.
+        cache_key_parts.append(orjson.dumps(body.filters, option=orjson.OPT_SORT_KEYS))
     
-    cache_key_string = ":".join(cache_key_parts)
-    query_hash = hashlib.md5(cache_key_string.encode()).hexdigest()
+    # Non-cryptographic use: BLAKE3 is SIMD-accelerated and a 16-byte digest keeps keys short.
+    query_hash = blake3(b":".join(cache_key_parts)).hexdigest(length=16)
     log_query_id = f"query_hash:{query_hash[:8]}"
-    cache_key = f"context_query:{query_hash}"
+    cache_key = f"context_chunks:{query_hash}"
 
     redis_client = request.app.state.redis_client
-    db_engine = request.app.state.db_engine
+    pg_pool = request.app.state.pg_pool
     db_table_name = request.app.state.db_table_name
-    embedding_model = request.app.state.embedding_model
-    reranker_model = getattr(request.app.state, 'reranker_model', None)
+    embedding_batcher = getattr(request.app.state, 'embedding_batcher', None)
+    rerank_batcher = getattr(request.app.state, 'rerank_batcher', None)
+
+    # The ETag covers the query, max_results and filters (via query_hash) and the index
+    # table, so a client's copy goes stale when a new index is loaded. It is weak because
+    # query_id and processing_time_ms differ between otherwise equivalent responses.
+    etag = f'W/"{query_hash}.{db_table_name}"'
+    if db_table_name and _etag_matches(request.headers.get("if-none-match"), etag):
+        logger.info(f"Client cache revalidated for {log_query_id}")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_client_cache_headers(etag))
 
-    if not embedding_model:
+    if not embedding_batcher:
         raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Embedding model is not available.")
 
-    # 1. Check Redis Cache
+    # 1. Check Redis Cache (response and query vector in a single round trip)
+    # The get-or-reserve script returns the cached response on a hit; on a miss it
+    # atomically reserves the key, so only one of several concurrent identical queries
+    # does the work.
+    vec_key = _query_vector_key(normalized_query)
+    cached_result = cached_vector = None
+    holds_lease = False
     if redis_client:
         try:
-            if cached_result := await redis_client.get(cache_key):
-                logger.info(f"Cache hit for {log_query_id}")
-                cached_data = orjson.loads(cached_result)
-                return ContextResponse(query_id=str(uuid.uuid4()), **cached_data)
+            cached_result, cached_vector = await request.app.state.cache_get_or_reserve(
+                keys=[cache_key, vec_key], args=[CACHE_LEASE, settings.REDIS_CACHE_LEASE_TTL_SECONDS]
+            )
+            holds_lease = cached_result is None
+            if cached_result == CACHE_LEASE:
+                logger.info(f"Waiting for in-flight computation of {log_query_id}")
+                cached_result = await _wait_for_cached_result(redis_client, cache_key)
         except Exception as e:
             logger.error(f"Redis cache check failed for {log_query_id}: {e}", exc_info=True)
+            cached_result = None
+
+    if cached_result:
+        logger.info(f"Cache hit for {log_query_id}")
+        return _render_context_response(cached_result, (time.perf_counter_ns() - start_ns) // 1_000_000, etag)
 
     logger.info(f"Cache miss for {log_query_id} with filters: {body.filters}")
 
-    if not db_engine or not db_table_name:
+    if not pg_pool or not db_table_name:
+        if holds_lease:
+            _run_in_background(request, _release_cache_lease(request.app.state.cache_release_lease, cache_key, log_query_id))
         raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Database connection is not available.")
 
     try:
-        loop = asyncio.get_running_loop()
-        thread_pool = request.app.state.thread_pool
-        query_vector = await loop.run_in_executor(
-            thread_pool, lambda: embedding_model.encode(normalized_query).tolist()
-        )
+        cache_writes: List[Tuple[str, bytes, int]] = []
+        if cached_vector:
+            logger.info(f"Query vector cache hit for {log_query_id}")
+            query_vector = np.frombuffer(cached_vector, dtype=np.float16).astype(np.float32)
+        else:
+            query_vector = await embedding_batcher.encode(normalized_query)
+            if redis_client:
+                # Raw float16 bytes: 2 bytes per dimension and no JSON parsing on read.
+                # The precision loss is far below what changes nearest-neighbour ranking.
+                vector_bytes = query_vector.astype(np.float16).tobytes()
+                cache_writes.append((vec_key, vector_bytes, settings.REDIS_QVEC_TTL_SECONDS))
         
-        n_results_retrieval = settings.RERANK_CANDIDATE_POOL_SIZE if reranker_model and settings.RERANKING_ENABLED else body.max_results
+        use_reranker = bool(rerank_batcher and settings.RERANKING_ENABLED)
+        n_results_retrieval = settings.RERANK_CANDIDATE_POOL_SIZE if use_reranker else body.max_results
         
-        # --- Build SQL Query Securely with Parameterization ---
-        params = {'query_vector': query_vector, 'limit': n_results_retrieval}
-        where_clauses = []
+        # --- Bind the query vector, limit and filter key/value pairs ---
+        args = [query_vector, n_results_retrieval]
         if body.filters:
-            for i, (key, value) in enumerate(body.filters.items()):
-                param_name = f"filter_val_{i}"
-                # This creates a clause like "metadata->>'language' = :filter_val_0"
-                # The value is passed separately in `params`, preventing SQL injection.
-                where_clauses.append(f"metadata->>'{key}' = :{param_name}")
-                params[param_name] = str(value)
-        
-        where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+            for key, value in body.filters.items():
+                # `->>` yields JSON text, so non-string values must match their JSON spelling (e.g. 'false').
+                args.extend((key, value if isinstance(value, str) else orjson.dumps(value).decode()))
 
-        sql_query = text(f"""
-            SELECT id, content, metadata, 1 - (embedding <-> :query_vector) AS score
-            FROM {db_table_name}
-            {where_sql}
-            ORDER BY score DESC
-            LIMIT :limit
-        """)
+        sql_query = _vector_search_sql(db_table_name, len(body.filters) if body.filters else 0)
 
-        async with db_engine.connect() as conn:
-            result = await conn.execute(sql_query, params)
-            rows = result.fetchall()
+        async with pg_pool.acquire() as conn:
+            rows = await conn.fetch(sql_query, *args)
 
-        docs, metadatas, scores = ([row.content for row in rows], [row.metadata for row in rows], [row.score for row in rows])
+        docs, metadatas, scores = ([row["content"] for row in rows], [row["metadata"] for row in rows], [row["score"] for row in rows])
 
         # 2. Rerank results if enabled
-        if reranker_model and settings.RERANKING_ENABLED and docs:
+        if use_reranker and docs:
             logger.info(f"Reranking initial {len(docs)} results for {log_query_id}...")
             rerank_pairs: List[Tuple[str, str]] = [(body.query, doc) for doc in docs]
-            rerank_scores = await loop.run_in_executor(thread_pool, lambda: reranker_model.predict(rerank_pairs))
+            rerank_scores = await rerank_batcher.predict(rerank_pairs)
             
-            reranked_results = sorted(zip(rerank_scores, docs, metadatas), key=lambda x: x[0], reverse=True)
-            final_results = reranked_results[:body.max_results]
-            final_scores, final_docs, final_metadatas = (zip(*final_results) if final_results else ([], [], []))
+            # Select the top-k in O(n) with argpartition, then sort only those k.
+            scores_np = np.asarray(rerank_scores)
+            k = min(body.max_results, scores_np.size)
+            top_idx = np.argpartition(-scores_np, k - 1)[:k]
+            top_idx = top_idx[np.argsort(-scores_np[top_idx])]
+            final_docs = [docs[i] for i in top_idx]
+            final_metadatas = [metadatas[i] for i in top_idx]
+            final_scores = scores_np[top_idx]
         else:
             final_docs, final_metadatas, final_scores = docs, metadatas, scores
 
         # 3. Format and cache the final response
-        context_chunks = [ContextChunk(content=doc, metadata=meta, score=float(score)) for doc, meta, score in zip(final_docs, final_metadatas, final_scores)]
-        
-        response_data = {
-            "context": context_chunks,
-            "processing_time_ms": int((time.monotonic() - start_time) * 1000)
-        }
+        # The context array is serialized once; the same bytes are cached and returned.
+        # Scores may be numpy scalars; orjson serializes them natively.
+        context_json = orjson.dumps(
+            [
+                {"content": doc, "metadata": meta, "score": score}
+                for doc, meta, score in zip(final_docs, final_metadatas, final_scores)
+            ],
+            option=orjson.OPT_SERIALIZE_NUMPY,
+        )
+
+        if redis_client and final_docs:
+            # Overwrites this request's lease, which releases any waiting workers.
+            cache_writes.append((cache_key, context_json, settings.REDIS_CACHE_TTL_SECONDS))
+            holds_lease = False
 
-        if redis_client and context_chunks:
-            try:
-                await redis_client.set(cache_key, orjson.dumps(response_data), ex=settings.REDIS_CACHE_TTL_SECONDS)
-                logger.info(f"Stored new cache entry for {log_query_id}")
-            except Exception as e:
-                logger.error(f"Redis cache store failed for {log_query_id}: {e}", exc_info=True)
+        # Populate the cache out-of-band so the Redis round trip is not on the response path.
+        if cache_writes:
+            _run_in_background(request, _store_cache_entries(redis_client, cache_writes, log_query_id))
+        if holds_lease:
+            _run_in_background(request, _release_cache_lease(request.app.state.cache_release_lease, cache_key, log_query_id))
 
-        return ContextResponse(query_id=str(uuid.uuid4()), **response_data)
+        return _render_context_response(context_json, (time.perf_counter_ns() - start_ns) // 1_000_000, etag)
 
     except Exception as e:
         logger.error(f"Error processing context request for {log_query_id}: {e}", exc_info=True)
+        if holds_lease:
+            _run_in_background(request, _release_cache_lease(request.app.state.cache_release_lease, cache_key, log_query_id))
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "An internal error occurred.")
@@ -2,27 +2,46 @@
 
 import asyncio
 import logging
-import psutil
-from fastapi import APIRouter, Request, Response, status as http_status
-from sqlalchemy import text
+import time
+from fastapi import APIRouter, Request, status as http_status
+from fastapi.responses import ORJSONResponse
 
-from app.models.schemas import HealthResponse, HealthStatus, IndexStatus, ResourceUsage
+from app.models.schemas import HealthResponse, HealthStatus, IndexStatus
 from app.core.config import settings 
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Frequent liveness probes share one Redis PING per window instead of one each.
+REDIS_STATUS_TTL_SECONDS = 2.0
+
+async def _get_redis_status(app_state) -> str:
+    now = time.monotonic()
+    if app_state.redis_status and now - app_state.redis_status_checked_at < REDIS_STATUS_TTL_SECONDS:
+        return app_state.redis_status
+
+    redis_status = "disconnected"
+    if redis_client := app_state.redis_client:
+        try:
+            await asyncio.wait_for(redis_client.ping(), timeout=1.0)
+            redis_status = "connected"
+        except Exception:
+            logger.warning("Health check failed to connect to Redis.")
+    app_state.redis_status = redis_status
+    app_state.redis_status_checked_at = now
+    return redis_status
+
 @router.get(
     "/health",
-    response_model=HealthResponse,
+    response_class=ORJSONResponse,
     summary="Get Service Health",
     tags=["Monitoring"],
     responses={
-        200: {"description": "Service is operational."},
-        503: {"description": "Service is in a degraded state."},
+        200: {"model": HealthResponse, "description": "Service is operational."},
+        503: {"model": HealthResponse, "description": "Service is in a degraded state."},
     }
 )
-async def get_health(request: Request, response: Response):
+async def get_health(request: Request):
     """
     Provides a detailed health status of the service, including database and model status.
     """
@@ -40,10 +59,11 @@ async def get_health(request: Request, response: Response):
     # Check Database Status
     db_status = "disconnected"
     is_db_healthy = False
-    if db_engine := app_state.db_engine:
+    # Probe the asyncpg pool that serves /context.
+    if pg_pool := app_state.pg_pool:
         try:
-            async with db_engine.connect() as conn:
-                await conn.execute(text("SELECT 1"))
+            async with pg_pool.acquire() as conn:
+                await conn.fetchval("SELECT 1")
             db_status = "connected"
             is_db_healthy = True
         except Exception:
@@ -51,40 +71,31 @@ async def get_health(request: Request, response: Response):
 
     # Determine Overall Service Status
     service_status = HealthStatus.OK if index_status == IndexStatus.LOADED and is_reranker_healthy and is_db_healthy else HealthStatus.DEGRADED
-    if service_status == HealthStatus.DEGRADED:
-        response.status_code = http_status.HTTP_503_SERVICE_UNAVAILABLE
+    status_code = http_status.HTTP_200_OK if service_status == HealthStatus.OK else http_status.HTTP_503_SERVICE_UNAVAILABLE
 
-    # Check Redis Status
-    redis_status = "disconnected"
-    if redis_client := request.app.state.redis_client:
-        try:
-            await asyncio.wait_for(redis_client.ping(), timeout=1.0)
-            redis_status = "connected"
-        except Exception:
-            logger.warning("Health check failed to connect to Redis.")
-            
-    # Get Resource Usage
-    try:
-        cpu_load = psutil.cpu_percent(interval=None)
-        memory_info = psutil.virtual_memory()
-        resource_usage = ResourceUsage(cpu_load_percent=cpu_load, memory_usage_percent=memory_info.percent)
-    except Exception as e:
-        logger.warning(f"Could not retrieve resource usage: {e}. This is non-fatal.")
-        resource_usage = ResourceUsage(cpu_load_percent=0.0, memory_usage_percent=0.0)
+    # Check Redis Status (cached for REDIS_STATUS_TTL_SECONDS)
+    redis_status = await _get_redis_status(app_state)
+
+    # Resource usage is sampled in the background by the lifespan task.
+    resource_usage = app_state.resource_usage
 
     index_branch = None
     if manifest := getattr(app_state, 'index_manifest', None):
         index_branch = manifest.get("branch")
     
-    return HealthResponse(
-        status=service_status,
-        version=request.app.version,
-        index_status=index_status,
-        db_status=db_status,
-        redis_status=redis_status, 
-        reranker_status=reranker_status,
-        index_last_modified=getattr(app_state, 'index_last_modified', None),
-        resource_usage=resource_usage,
-        index_branch=index_branch,
-        db_table_name=getattr(app_state, 'db_table_name', None)
+    # Plain dict in HealthResponse's field order; orjson handles the enums and datetime natively.
+    return ORJSONResponse(
+        status_code=status_code,
+        content={
+            "status": service_status,
+            "version": request.app.version,
+            "index_status": index_status,
+            "db_status": db_status,
+            "redis_status": redis_status,
+            "reranker_status": reranker_status,
+            "index_last_modified": getattr(app_state, 'index_last_modified', None),
+            "resource_usage": resource_usage,
+            "index_branch": index_branch,
+            "db_table_name": getattr(app_state, 'db_table_name', None),
+        },
     )
@@ -0,0 +1,194 @@
+# app\core\batching.py
+
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Any, Callable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceBatcher:
+    """
+    Coalesces concurrent inference calls into a single batched model call.
+
+    Callers submit a list of inputs and await their slice of the results. A single
+    background task drains the queue, waiting at most `max_wait_ms` (or until
+    `max_batch_size` inputs are queued) before running `infer_fn` on the combined
+    batch in the given executor. The optional `semaphore` bounds how many batches
+    may be in flight at once; while it is exhausted, new requests keep queueing
+    and are folded into the next batch.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        infer_fn: Callable[[List[Any]], Sequence[Any]],
+        executor: Executor,
+        max_batch_size: int,
+        max_wait_ms: float,
+        semaphore: Optional[asyncio.Semaphore] = None,
+    ):
+        self.name = name
+        self._infer_fn = infer_fn
+        self._executor = executor
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000.0
+        self._queue: asyncio.Queue[Tuple[List[Any], asyncio.Future]] = asyncio.Queue()
+        self._semaphore = semaphore or asyncio.Semaphore(1)
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"{self.name}-batcher")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._inflight):
+            task.cancel()
+
+    async def submit(self, items: List[Any]) -> Sequence[Any]:
+        """Queues `items` for the next batch and returns their results in order."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((items, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[List[Any], asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        size = len(batch[0][0])
+        deadline = loop.time() + self._max_wait
+        while size < self._max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                entry = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(entry)
+            size += len(entry[0])
+        return batch
+
+    async def _dispatch(self, batch: List[Tuple[List[Any], asyncio.Future]]) -> None:
+        # Drop callers that gave up (e.g. client disconnects) before spending compute on them.
+        batch = [(items, future) for items, future in batch if not future.done()]
+        if not batch:
+            return
+
+        inputs = [item for items, _ in batch for item in items]
+        loop = asyncio.get_running_loop()
+        try:
+            # run_in_executor wraps the worker's concurrent future, so results are
+            # delivered back on the event loop thread.
+            results = await loop.run_in_executor(self._executor, self._infer_fn, inputs)
+        except Exception as e:
+            logger.error(f"{self.name} batch of {len(inputs)} inputs failed: {e}", exc_info=True)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for items, future in batch:
+            if not future.done():
+                future.set_result(results[offset:offset + len(items)])
+            offset += len(items)
+
+    async def _dispatch_and_release(self, batch: List[Tuple[List[Any], asyncio.Future]]) -> None:
+        try:
+            await self._dispatch(batch)
+        finally:
+            self._semaphore.release()
+
+    async def _run(self) -> None:
+        while True:
+            await self._semaphore.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._semaphore.release()
+                raise
+            task = asyncio.create_task(self._dispatch_and_release(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+
+class EmbeddingBatcher(InferenceBatcher):
+    """
+    Micro-batches query encodes for a SentenceTransformer model.
+
+    With `normalize=True` vectors are L2-normalized inside the model call, so inner
+    product search can stand in for cosine without a per-query norm in the database.
+    """
+
+    def __init__(
+        self,
+        model,
+        executor: Executor,
+        max_batch_size: int,
+        max_wait_ms: float,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        normalize: bool = False,
+    ):
+        super().__init__(
+            "embedding",
+            # A single float32 ndarray for the batch; rows are handed out as views, never lists.
+            lambda texts: model.encode(
+                texts,
+                batch_size=len(texts),
+                convert_to_numpy=True,
+                normalize_embeddings=normalize,
+                show_progress_bar=False,
+            ),
+            executor,
+            max_batch_size,
+            max_wait_ms,
+            semaphore,
+        )
+
+    async def encode(self, text: str) -> np.ndarray:
+        vectors = await self.submit([text])
+        return vectors[0]
+
+
+class RerankBatcher(InferenceBatcher):
+    """
+    Micro-batches (query, document) scoring for a FastCrossEncoder model.
+
+    Pairs from all coalesced requests are scored in one `predict_pairs` call, which
+    tokenizes each distinct query once for the whole batch.
+
+    `forward_batch_size` caps how many pairs go through a single forward pass, so a
+    large coalesced batch is not padded to the longest document in the whole set.
+    """
+
+    def __init__(
+        self,
+        model,
+        executor: Executor,
+        max_batch_size: int,
+        max_wait_ms: float,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        forward_batch_size: int = 32,
+    ):
+        super().__init__(
+            "rerank",
+            lambda pairs: model.predict_pairs(pairs, batch_size=forward_batch_size),
+            executor,
+            max_batch_size,
+            max_wait_ms,
+            semaphore,
+        )
+
+    async def predict(self, pairs: List[Tuple[str, str]]) -> Sequence[float]:
+        return await self.submit(pairs)
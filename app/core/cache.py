@@ -0,0 +1,38 @@
+# app\core\cache.py
+
+import redis.asyncio as redis
+from typing import Tuple
+from redis.commands.core import AsyncScript
+
+# Placeholder stored under a response cache key while one worker computes it.
+CACHE_LEASE = b"__pending__"
+
+# KEYS: response cache key, query vector key. ARGV: lease value, lease TTL in seconds.
+# Returns {cached response or nil, cached query vector or nil}. On a response miss the
+# key is reserved with the lease, so the check, the reservation and the vector lookup
+# all happen server-side in one round trip.
+GET_OR_RESERVE_LUA = """
+local cached = redis.call('GET', KEYS[1])
+if not cached then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+end
+return {cached, redis.call('GET', KEYS[2])}
+"""
+
+# Deletes the key only if it still holds our lease, never a result stored by another worker.
+RELEASE_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+async def register_cache_scripts(redis_client: redis.Redis) -> Tuple[AsyncScript, AsyncScript]:
+    """
+    Loads the cache scripts into Redis and returns callables that invoke them via EVALSHA.
+
+    redis-py re-sends a script transparently if the server's script cache was flushed.
+    """
+    for source in (GET_OR_RESERVE_LUA, RELEASE_LEASE_LUA):
+        await redis_client.script_load(source)
+    return redis_client.register_script(GET_OR_RESERVE_LUA), redis_client.register_script(RELEASE_LEASE_LUA)
@@ -1,8 +1,8 @@
 #app\core\config.py
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from pydantic import Field, root_validator, model_validator
-from typing import Optional
+from pydantic import Field, model_validator
+from typing import Literal, Optional
 
 class Settings(BaseSettings):
     """Librarian Service Configuration loaded from environment variables and secrets."""
@@ -18,8 +18,26 @@ class Settings(BaseSettings):
 
     # Service Performance
     MAX_WORKERS: int = Field(4, env="MAX_WORKERS")
+    TORCH_NUM_THREADS: Optional[int] = Field(None, gt=0, env="TORCH_NUM_THREADS")
+    # Throughput-over-latency option for sustained concurrent load; see configure_torch_threads.
+    TORCH_SPLIT_THREADS_ACROSS_BATCHES: bool = Field(False, env="TORCH_SPLIT_THREADS_ACROSS_BATCHES")
+    # /health serves CPU and memory figures sampled in the background at this interval.
+    RESOURCE_SAMPLE_INTERVAL_SECONDS: float = Field(5.0, gt=0, env="RESOURCE_SAMPLE_INTERVAL_SECONDS")
+
+    # --- Inference Micro-Batching ---
+    EMBED_MAX_BATCH_SIZE: int = Field(32, gt=0, env="EMBED_MAX_BATCH_SIZE")
+    EMBED_BATCH_MAX_WAIT_MS: float = Field(8.0, ge=0, env="EMBED_BATCH_MAX_WAIT_MS")
+    RERANK_MAX_BATCH_SIZE: int = Field(128, gt=0, env="RERANK_MAX_BATCH_SIZE")
+    RERANK_BATCH_MAX_WAIT_MS: float = Field(8.0, ge=0, env="RERANK_BATCH_MAX_WAIT_MS")
+    # Upper bound on in-flight inference batches per model, independent of the rate limiter.
+    MAX_CONCURRENT_EMBED: int = Field(1, gt=0, env="MAX_CONCURRENT_EMBED")
+    MAX_CONCURRENT_RERANK: int = Field(1, gt=0, env="MAX_CONCURRENT_RERANK")
       
     EMBEDDING_MODEL_NAME: str = Field("BAAI/bge-large-en-v1.5", env="EMBEDDING_MODEL_NAME")
+    EMBEDDING_BACKEND: Literal["torch", "onnx"] = Field("torch", env="EMBEDDING_BACKEND")
+    EMBEDDING_ONNX_FILE_NAME: str = Field("onnx/model_qint8_avx512_vnni.onnx", env="EMBEDDING_ONNX_FILE_NAME")
+    # Dynamic int8 quantization of Linear layers for the torch backend on CPU.
+    EMBEDDING_QUANTIZE_INT8: bool = Field(False, env="EMBEDDING_QUANTIZE_INT8")
     STARTUP_TIMEOUT_SECONDS: int = Field(300, env="STARTUP_TIMEOUT_SECONDS")
     
     # --- Reranking Configuration ---
@@ -30,6 +48,12 @@ class Settings(BaseSettings):
         gt=0, 
         description="Number of initial candidates to retrieve from vector search for reranking."
     )
+    RERANK_BATCH_SIZE: int = Field(32, gt=0, env="RERANK_BATCH_SIZE")
+    # Cap on query+document tokens per pair; retrieved chunks rarely need more than 256.
+    RERANKER_MAX_LENGTH: int = Field(256, gt=0, env="RERANKER_MAX_LENGTH")
+    RERANKER_BACKEND: Literal["torch", "onnx"] = Field("torch", env="RERANKER_BACKEND")
+    RERANKER_ONNX_FILE_NAME: str = Field("onnx/model_qint8_avx512_vnni.onnx", env="RERANKER_ONNX_FILE_NAME")
+    RERANKER_QUANTIZE_INT8: bool = Field(False, env="RERANKER_QUANTIZE_INT8")
     
     # API Authentication (supports Docker secrets)
     LIBRARIAN_API_KEY: Optional[str] = Field(None, env="LIBRARIAN_API_KEY")
@@ -48,35 +72,51 @@ class Settings(BaseSettings):
 
     # PostgreSQL Database
     DATABASE_URL: str = Field(..., env="DATABASE_URL")
+    DB_POOL_SIZE: int = Field(10, gt=0, env="DB_POOL_SIZE")
+    # At least one connection is opened at startup, which doubles as the connectivity check.
+    DB_POOL_MIN_SIZE: int = Field(4, gt=0, env="DB_POOL_MIN_SIZE")
+    # Prepared statements kept per connection; one per distinct filter count is needed.
+    DB_STATEMENT_CACHE_SIZE: int = Field(256, ge=0, env="DB_STATEMENT_CACHE_SIZE")
+    DB_COMMAND_TIMEOUT_SECONDS: float = Field(30.0, gt=0, env="DB_COMMAND_TIMEOUT_SECONDS")
+    # 'inner_product' requires unit-normalized vectors in the table and an index built
+    # with vector_ip_ops; it must match how the index producer stored the embeddings.
+    VECTOR_DISTANCE_METRIC: Literal["l2", "inner_product"] = Field("l2", env="VECTOR_DISTANCE_METRIC")
+    # pgvector HNSW candidate list size per query (hnsw.ef_search, server default 40).
+    # Must stay >= the number of rows fetched, or HNSW scans may return fewer rows.
+    VECTOR_HNSW_EF_SEARCH: Optional[int] = Field(None, gt=0, env="VECTOR_HNSW_EF_SEARCH")
 
     # Redis Cache
     REDIS_URL: str = Field("redis://localhost:6379/0", env="REDIS_URL")
+    # Upper bound on sockets to Redis; concurrent commands beyond it wait for a free connection.
+    REDIS_MAX_CONNECTIONS: int = Field(64, gt=0, env="REDIS_MAX_CONNECTIONS")
     REDIS_CACHE_TTL_SECONDS: int = Field(3600, env="REDIS_CACHE_TTL_SECONDS")
+    REDIS_QVEC_TTL_SECONDS: int = Field(86400, env="REDIS_QVEC_TTL_SECONDS")
+    # A cache miss reserves its key so concurrent identical queries wait for one result
+    # instead of all running retrieval and reranking.
+    REDIS_CACHE_LEASE_TTL_SECONDS: int = Field(30, gt=0, env="REDIS_CACHE_LEASE_TTL_SECONDS")
+    REDIS_CACHE_LEASE_WAIT_MS: int = Field(2000, ge=0, env="REDIS_CACHE_LEASE_WAIT_MS")
 
-    @root_validator(pre=False, skip_on_failure=True)
-    def process_derived_settings(cls, values):
+    @model_validator(mode='after')
+    def process_derived_settings(self) -> 'Settings':
         """
         Load secrets from files and derive dynamic configuration values after initial load.
         """
-        api_key_file = values.get("LIBRARIAN_API_KEY_FILE")
-        if api_key_file:
+        if self.LIBRARIAN_API_KEY_FILE:
             try:
-                with open(api_key_file, 'r') as f:
-                    values["LIBRARIAN_API_KEY"] = f.read().strip()
+                with open(self.LIBRARIAN_API_KEY_FILE, 'r') as f:
+                    self.LIBRARIAN_API_KEY = f.read().strip()
             except IOError:
-                raise ValueError(f"Could not read API key from file: {api_key_file}")
+                raise ValueError(f"Could not read API key from file: {self.LIBRARIAN_API_KEY_FILE}")
         
-        if not values.get("LIBRARIAN_API_KEY"):
+        if not self.LIBRARIAN_API_KEY:
             raise ValueError("LIBRARIAN_API_KEY must be set, either via environment variable or LIBRARIAN_API_KEY_FILE.")
             
-        project = values.get("OCI_PROJECT_NAME")
-        branch = values.get("OCI_INDEX_BRANCH")            
-        if project and branch:
-            values["OCI_INDEX_OBJECT_NAME"] = f"indexes/{project}/{branch}/latest/index_manifest.json"
+        if self.OCI_PROJECT_NAME and self.OCI_INDEX_BRANCH:
+            self.OCI_INDEX_OBJECT_NAME = f"indexes/{self.OCI_PROJECT_NAME}/{self.OCI_INDEX_BRANCH}/latest/index_manifest.json"
         else:
             raise ValueError("OCI_PROJECT_NAME and OCI_INDEX_BRANCH must be set to derive the object name.")
             
-        return values
+        return self
 
     @model_validator(mode='after')
     def validate_reranking_pool(self) -> 'Settings':
@@ -84,4 +124,4 @@ class Settings(BaseSettings):
             raise ValueError("RERANK_CANDIDATE_POOL_SIZE must be at least 5 when reranking is enabled.")
         return self
 
-settings = Settings()
+settings = Settings()
\ No newline at end of file
@@ -0,0 +1,67 @@
+# app\core\database.py
+
+import logging
+import asyncpg
+import orjson
+from pgvector.asyncpg import register_vector
+from sqlalchemy.engine import make_url
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# Session settings sent in the startup packet of every pool connection.
+# Short ANN queries never benefit from JIT, but can trip its cost threshold and pay a
+# compilation stall. Server-side TCP keepalives keep long-lived idle connections from
+# being silently dropped by NAT/firewalls, so they need not be recycled on a timer.
+SERVER_SETTINGS = {
+    "application_name": "librarian",
+    "jit": "off",
+    "tcp_keepalives_idle": "60",
+}
+
+def _asyncpg_dsn(database_url: str) -> str:
+    """Strips any SQLAlchemy driver suffix (e.g. 'postgresql+asyncpg') so asyncpg can use the URL."""
+    return make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+def _encode_json(value) -> str:
+    return orjson.dumps(value).decode()
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    """
+    Registers per-connection codecs: pgvector in binary for query vectors, and orjson
+    for json/jsonb so `metadata` arrives as a dict without going through stdlib `json`.
+    """
+    await register_vector(conn)
+    for json_type in ("json", "jsonb"):
+        await conn.set_type_codec(
+            json_type,
+            encoder=_encode_json,
+            decoder=orjson.loads,
+            schema="pg_catalog",
+            format="text",
+        )
+
+async def create_pg_pool() -> asyncpg.Pool:
+    """
+    Creates the asyncpg pool used for hot-path vector queries.
+
+    asyncpg keeps a per-connection prepared statement cache keyed by SQL text, so
+    queries with a stable text are parsed and planned once per connection.
+    """
+    logger.info("Creating asyncpg connection pool for vector queries...")
+    server_settings = SERVER_SETTINGS
+    if settings.VECTOR_HNSW_EF_SEARCH:
+        # Sent in the startup packet, so it becomes the session default and survives the
+        # RESET ALL that asyncpg runs when a connection is released back to the pool.
+        server_settings = {**SERVER_SETTINGS, "hnsw.ef_search": str(settings.VECTOR_HNSW_EF_SEARCH)}
+    return await asyncpg.create_pool(
+        dsn=_asyncpg_dsn(settings.DATABASE_URL),
+        # Warm connections avoid a handshake on the first queries of a burst.
+        min_size=min(settings.DB_POOL_MIN_SIZE, settings.DB_POOL_SIZE),
+        max_size=settings.DB_POOL_SIZE,
+        statement_cache_size=settings.DB_STATEMENT_CACHE_SIZE,
+        command_timeout=settings.DB_COMMAND_TIMEOUT_SECONDS,
+        init=_init_connection,
+        server_settings=server_settings,
+    )
@@ -7,6 +7,10 @@ from .config import settings
 
 api_key_header = APIKeyHeader(name="X-API-KEY", auto_error=False)
 
+# Encoded once: compare_digest on bytes needs no per-request settings lookup, and unlike
+# str arguments it accepts non-ASCII header values instead of raising TypeError.
+_API_KEY_BYTES = settings.LIBRARIAN_API_KEY.encode("utf-8")
+
 async def get_api_key(api_key: str = Security(api_key_header)):
     """Dependency to validate the X-API-KEY header."""
     if not api_key:
@@ -17,7 +21,7 @@ async def get_api_key(api_key: str = Security(api_key_header)):
 
     # Use constant-time comparison to prevent timing attacks.
     # This is the recommended way to compare secrets.
-    if not hmac.compare_digest(api_key, settings.LIBRARIAN_API_KEY):
+    if not hmac.compare_digest(api_key.encode("utf-8"), _API_KEY_BYTES):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Invalid API Key",
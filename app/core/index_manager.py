@@ -4,6 +4,7 @@ import oci
 import logging
 import orjson
 import asyncio
+from functools import lru_cache
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from .config import settings
@@ -40,14 +41,24 @@ def _get_oci_signer():
         logger.info("Successfully authenticated using OCI config file.")
         return config, signer
 
+@lru_cache(maxsize=1)
+def _get_object_storage_client():
+    """
+    Returns a process-wide ObjectStorageClient and the tenancy's namespace.
+
+    Authentication (including the Instance Principal probe), the client's HTTP session
+    and the namespace lookup are set up once and reused for every later download.
+    """
+    config, signer = _get_oci_signer()
+    object_storage_client = oci.object_storage.ObjectStorageClient(config, signer=signer)
+    namespace = object_storage_client.get_namespace().data
+    return object_storage_client, namespace
+
 def _blocking_download_and_parse_manifest():
     """Synchronous helper to be run in a thread pool."""
     logger.info(f"Attempting to download '{settings.OCI_INDEX_OBJECT_NAME}' from bucket '{settings.OCI_BUCKET_NAME}'...")
     try:
-        config, signer = _get_oci_signer()
-        object_storage_client = oci.object_storage.ObjectStorageClient(config, signer=signer)
-        
-        namespace = object_storage_client.get_namespace().data
+        object_storage_client, namespace = _get_object_storage_client()
 
         get_obj = object_storage_client.get_object(
             namespace_name=namespace,
@@ -55,7 +66,9 @@ def _blocking_download_and_parse_manifest():
             object_name=settings.OCI_INDEX_OBJECT_NAME
         )
         
-        manifest_content = get_obj.data.raw.read()
+        # The manifest is a few hundred bytes: read the whole body in one call rather than
+        # through the raw urllib3 stream, which also undoes any Content-Encoding.
+        manifest_content = get_obj.data.content
         logger.info("Successfully downloaded manifest from OCI.")
         return orjson.loads(manifest_content)
     except oci.exceptions.ServiceError as e:
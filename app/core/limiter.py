@@ -1,12 +1,62 @@
 # app\core\limiter.py
 
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+import logging
+import time
+from typing import Tuple
+from fastapi import HTTPException, Request, status
 from .config import settings
 
-# Create the single, shared limiter instance.
-# It is configured from the settings file and will be imported by other parts of the app.
-limiter = Limiter(
-    key_func=get_remote_address,
-    enabled=settings.RATE_LIMIT_ENABLED
-)
\ No newline at end of file
+logger = logging.getLogger(__name__)
+
+_PERIOD_SECONDS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+def parse_rate_limit(rate: str) -> Tuple[int, int]:
+    """Parses a limit such as '100/minute' into (max requests, window in seconds)."""
+    count, _, period = rate.partition("/")
+    period = period.strip().lower().rstrip("s")
+    if not count.strip().isdigit() or period not in _PERIOD_SECONDS:
+        raise ValueError(f"Invalid RATE_LIMIT_TIMEFRAME '{rate}'. Expected e.g. '100/minute'.")
+    return int(count), _PERIOD_SECONDS[period]
+
+RATE_LIMIT, RATE_LIMIT_WINDOW_SECONDS = parse_rate_limit(settings.RATE_LIMIT_TIMEFRAME)
+
+async def rate_limit(request: Request) -> None:
+    """
+    Sliding-window rate limit per client address, counted in Redis.
+
+    Uses the two-bucket approximation: the previous window's count is weighted by how
+    much of it still overlaps the sliding window, so there is no burst of 2x the limit
+    at window boundaries as with a fixed window. INCR, EXPIRE and the previous-window
+    GET go out as one pipelined round trip, and counters are shared by every worker
+    process. The limiter fails open when Redis is unavailable, as the response cache does.
+    """
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+    redis_client = request.app.state.redis_client
+    if not redis_client:
+        return
+
+    client_host = request.client.host if request.client else "unknown"
+    now = time.time()
+    window, elapsed = divmod(now, RATE_LIMIT_WINDOW_SECONDS)
+    window = int(window)
+    key = f"rl:{client_host}:{window}"
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.incr(key)
+            # Kept for a second window so it can serve as the previous bucket.
+            pipe.expire(key, 2 * RATE_LIMIT_WINDOW_SECONDS)
+            pipe.get(f"rl:{client_host}:{window - 1}")
+            current, _, previous = await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Rate limit check failed, allowing request: {e}")
+        return
+
+    previous_weight = 1.0 - elapsed / RATE_LIMIT_WINDOW_SECONDS
+    if current + int(previous or 0) * previous_weight > RATE_LIMIT:
+        retry_after = max(1, int(RATE_LIMIT_WINDOW_SECONDS - elapsed))
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Rate limit exceeded: {settings.RATE_LIMIT_TIMEFRAME}",
+            headers={"Retry-After": str(retry_after)},
+        )
@@ -0,0 +1,184 @@
+# app\core\model_manager.py
+
+import logging
+import os
+import numpy as np
+import torch
+from typing import Sequence, Tuple
+from sentence_transformers import SentenceTransformer, CrossEncoder
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class FastCrossEncoder(CrossEncoder):
+    """
+    CrossEncoder that tokenizes each distinct query once per call.
+
+    `CrossEncoder.predict` re-tokenizes the query for every (query, doc) pair. Here the
+    query and document token ids are computed separately and joined with the model's
+    own special-token template (`[CLS] q [SEP] d [SEP]` for BERT-style models), which
+    yields the same features with one query tokenization instead of N.
+    """
+
+    def predict_pairs(self, pairs: Sequence[Tuple[str, str]], batch_size: int = 32) -> np.ndarray:
+        tokenizer = self.tokenizer
+        max_length = self.max_length
+
+        unique_queries = list(dict.fromkeys(query for query, _ in pairs))
+        query_token_ids = dict(zip(
+            unique_queries,
+            tokenizer(unique_queries, add_special_tokens=False, truncation=True, max_length=max_length)["input_ids"],
+        ))
+        doc_token_ids = tokenizer(
+            [doc for _, doc in pairs], add_special_tokens=False, truncation=True, max_length=max_length
+        )["input_ids"]
+
+        batch_scores = []
+        for start in range(0, len(pairs), batch_size):
+            encoded = [
+                tokenizer.prepare_for_model(
+                    query_token_ids[query], doc_ids, truncation="longest_first", max_length=max_length
+                )
+                for (query, _), doc_ids in zip(pairs[start:start + batch_size], doc_token_ids[start:start + batch_size])
+            ]
+            features = tokenizer.pad(encoded, padding=True, return_tensors="pt").to(self.model.device)
+            with torch.inference_mode():
+                logits = self.model(**features, return_dict=True).logits
+                batch_scores.append(self.activation_fn(logits).float().cpu())
+
+        scores = torch.cat(batch_scores)
+        if scores.shape[1] == 1:
+            scores = scores[:, 0]
+        return scores.numpy()
+
+
+def _available_cpus() -> int:
+    # The affinity mask reflects container cpusets; os.cpu_count() reports the whole host.
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def configure_torch_threads() -> None:
+    """
+    Sizes torch's intra-op thread pool.
+
+    TORCH_NUM_THREADS wins when set. Otherwise torch keeps its default of one thread per
+    core, which gives the lowest single-request latency: within a request, embedding and
+    reranking run one after the other, so they only compete under concurrent load.
+
+    Each inference thread that enters torch drives its own team of intra-op threads, so
+    when embed and rerank batches routinely overlap the default oversubscribes the CPU.
+    TORCH_SPLIT_THREADS_ACROSS_BATCHES opts into splitting the CPUs this process may run
+    on evenly across the MAX_CONCURRENT_EMBED + MAX_CONCURRENT_RERANK batches instead.
+    """
+    num_threads = settings.TORCH_NUM_THREADS
+    if not num_threads and settings.TORCH_SPLIT_THREADS_ACROSS_BATCHES:
+        concurrent_batches = settings.MAX_CONCURRENT_EMBED
+        if settings.RERANKING_ENABLED:
+            concurrent_batches += settings.MAX_CONCURRENT_RERANK
+        num_threads = max(1, _available_cpus() // concurrent_batches)
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    logger.info(f"torch intra-op threads: {torch.get_num_threads()}")
+
+def _use_half_precision(module: torch.nn.Module) -> bool:
+    # fp16 halves memory bandwidth on GPUs; on CPU most kernels lack fast fp16 paths.
+    return next(module.parameters()).device.type == "cuda"
+
+def _quantize_int8(module: torch.nn.Module) -> torch.nn.Module:
+    """
+    Swaps the module's Linear layers for dynamically quantized int8 versions, in place.
+
+    Weights are stored as int8 and activations are quantized per batch, so no
+    calibration data is needed. On CPUs with VNNI/AMX the matmuls use int8 kernels.
+    """
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def _onnx_model_kwargs(file_name: str) -> dict:
+    """
+    Builds ONNX Runtime loading arguments for the sentence-transformers `onnx` backend.
+
+    All graph optimizations (node fusions, constant folding, layout changes) are enabled,
+    and the intra-op pool is sized like torch's (see configure_torch_threads).
+    """
+    import onnxruntime as ort
+
+    session_options = ort.SessionOptions()
+    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session_options.intra_op_num_threads = torch.get_num_threads()
+    return {
+        "file_name": file_name,
+        "provider": "CPUExecutionProvider",
+        "session_options": session_options,
+    }
+
+def load_embedding_model() -> SentenceTransformer:
+    """
+    Loads the query encoder. Blocking; run it in a thread pool.
+
+    With EMBEDDING_BACKEND=onnx the encoder runs on ONNX Runtime using the file named
+    by EMBEDDING_ONNX_FILE_NAME; `encode()` still returns float32 numpy arrays.
+    The torch backend runs in fp16 on CUDA, or in int8 on CPU with EMBEDDING_QUANTIZE_INT8.
+    """
+    if settings.EMBEDDING_BACKEND == "onnx":
+        logger.info(f"Using ONNX Runtime backend for embedding model ('{settings.EMBEDDING_ONNX_FILE_NAME}').")
+        return SentenceTransformer(
+            settings.EMBEDDING_MODEL_NAME,
+            backend="onnx",
+            model_kwargs=_onnx_model_kwargs(settings.EMBEDDING_ONNX_FILE_NAME),
+        )
+    model = SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
+    if _use_half_precision(model):
+        model.half()
+    elif settings.EMBEDDING_QUANTIZE_INT8:
+        logger.info("Applying dynamic int8 quantization to embedding model.")
+        _quantize_int8(model)
+    return model
+
+def load_reranker_model() -> FastCrossEncoder:
+    """
+    Loads the reranking cross-encoder. Blocking; run it in a thread pool.
+
+    With RERANKER_BACKEND=onnx the model is served by ONNX Runtime on the CPU
+    execution provider, using the (typically int8-quantized) file named by
+    RERANKER_ONNX_FILE_NAME. The returned object keeps the CrossEncoder interface,
+    so callers are unaffected. Pairs are truncated to RERANKER_MAX_LENGTH tokens.
+    The torch backend runs in fp16 on CUDA, or in int8 on CPU with RERANKER_QUANTIZE_INT8.
+    """
+    if settings.RERANKER_BACKEND == "onnx":
+        logger.info(f"Using ONNX Runtime backend for reranker ('{settings.RERANKER_ONNX_FILE_NAME}').")
+        return FastCrossEncoder(
+            settings.RERANKER_MODEL_NAME,
+            max_length=settings.RERANKER_MAX_LENGTH,
+            backend="onnx",
+            model_kwargs=_onnx_model_kwargs(settings.RERANKER_ONNX_FILE_NAME),
+        )
+    model = FastCrossEncoder(settings.RERANKER_MODEL_NAME, max_length=settings.RERANKER_MAX_LENGTH)
+    if _use_half_precision(model.model):
+        model.model.half()
+    elif settings.RERANKER_QUANTIZE_INT8:
+        logger.info("Applying dynamic int8 quantization to reranker model.")
+        _quantize_int8(model.model)
+    return model
+
+def warm_up_embedding_model(model: SentenceTransformer, normalize: bool) -> None:
+    """
+    Runs a throwaway batch through the encoder, with the same call the batcher makes.
+
+    The first forward pass pays for kernel selection, allocator growth and (on ONNX
+    Runtime) session initialization. Run it on the inference executor at startup so
+    the first real query sees steady-state latency.
+    """
+    model.encode(
+        ["warmup"] * 4,
+        batch_size=4,
+        convert_to_numpy=True,
+        normalize_embeddings=normalize,
+        show_progress_bar=False,
+    )
+
+def warm_up_reranker_model(model: FastCrossEncoder, batch_size: int) -> None:
+    """Runs a throwaway batch of pairs through the reranker; see warm_up_embedding_model."""
+    model.predict_pairs([("warmup query", "warmup document")] * 4, batch_size=batch_size)
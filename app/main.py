@@ -1,29 +1,27 @@
 #  app\main.py
 
-import uvloop
-uvloop.install() 
-
 import logging
 import asyncio
+import importlib
 import sys 
 import orjson
+import psutil
 import redis.asyncio as redis
 from contextlib import asynccontextmanager
 from concurrent.futures import ThreadPoolExecutor 
-from fastapi import FastAPI
-from fastapi.responses import ORJSONResponse
-from datetime import datetime
-from sentence_transformers import SentenceTransformer, CrossEncoder
-from slowapi import _rate_limit_exceeded_handler
-from slowapi.errors import RateLimitExceeded
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy import text
-
-from app.core.limiter import limiter
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse, Response
+from fastapi.utils import is_body_allowed_for_status_code
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from datetime import datetime, timezone
+
 from app.core.config import settings
 from app.api.v1.router import api_router
 from app.models.schemas import IndexStatus
 from app.core import index_manager
+from app.core.database import create_pg_pool
+from app.core.cache import register_cache_scripts
+from app.core.batching import EmbeddingBatcher, RerankBatcher
 
 logging.basicConfig(
     level=settings.LOG_LEVEL.upper(),
@@ -42,32 +40,115 @@ def _handle_startup_errors(task: asyncio.Task) -> None:
         )
         sys.exit(1)
 
+async def orjson_http_exception_handler(request: Request, exc: StarletteHTTPException) -> Response:
+    """
+    FastAPI's default HTTPException handler, but serializing with orjson.
+
+    Covers 401/403/404/429/503 responses, which are most frequent exactly when the
+    service is under pressure (e.g. rate-limited bursts).
+    """
+    headers = getattr(exc, "headers", None)
+    if not is_body_allowed_for_status_code(exc.status_code):
+        return Response(status_code=exc.status_code, headers=headers)
+    return ORJSONResponse({"detail": exc.detail}, status_code=exc.status_code, headers=headers)
+
+async def sample_resources_loop(app: FastAPI, interval: float) -> None:
+    """
+    Refreshes CPU and memory usage on app.state every `interval` seconds.
+
+    psutil reads /proc synchronously; sampling here keeps that work off the /health
+    request path. cpu_percent(interval=None) measures usage since the previous call,
+    so each value covers the whole preceding interval.
+    """
+    while True:
+        try:
+            app.state.resource_usage = {
+                "cpu_load_percent": psutil.cpu_percent(interval=None),
+                "memory_usage_percent": psutil.virtual_memory().percent,
+            }
+        except Exception as e:
+            logger.warning(f"Could not retrieve resource usage: {e}. This is non-fatal.")
+        await asyncio.sleep(interval)
+
 async def load_dependencies(app: FastAPI):
     logger.info("Background task started: Loading dependencies...")
     loop = asyncio.get_running_loop()
     thread_pool = app.state.thread_pool
 
+    # DNS, TLS and the Postgres handshake overlap with model loading.
+    # create_pg_pool opens DB_POOL_MIN_SIZE connections, so it also verifies connectivity.
+    db_connect_task = asyncio.create_task(create_pg_pool())
+
     try:
         # --- Load Models ---
-        logger.info("Loading sentence-transformer model into memory...")
-        app.state.embedding_model = await loop.run_in_executor(
-            thread_pool, lambda: SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
+        # torch and sentence-transformers take seconds to import. The model manager is
+        # imported here, on the thread pool, so the listener binds and /health answers
+        # without waiting for them.
+        model_manager = await loop.run_in_executor(
+            thread_pool, importlib.import_module, "app.core.model_manager"
         )
-        logger.info(f"Model '{settings.EMBEDDING_MODEL_NAME}' loaded successfully.")
-
+        model_manager.configure_torch_threads()
+        # The two models are independent, so load them concurrently on the thread pool.
+        logger.info("Loading sentence-transformer model into memory...")
+        load_futures = [loop.run_in_executor(thread_pool, model_manager.load_embedding_model)]
         if settings.RERANKING_ENABLED:
             logger.info("Reranking is enabled. Loading CrossEncoder model...")
-            try:
-                app.state.reranker_model = await loop.run_in_executor(
-                    thread_pool, lambda: CrossEncoder(settings.RERANKER_MODEL_NAME)
-                )
-                logger.info(f"Reranker model '{settings.RERANKER_MODEL_NAME}' loaded successfully.")
-            except Exception as e:
+            load_futures.append(loop.run_in_executor(thread_pool, model_manager.load_reranker_model))
+        embedding_model, *reranker_result = await asyncio.gather(*load_futures, return_exceptions=True)
+
+        if isinstance(embedding_model, BaseException):
+            raise embedding_model
+        app.state.embedding_model = embedding_model
+        logger.info(f"Model '{settings.EMBEDDING_MODEL_NAME}' loaded successfully.")
+        normalize_embeddings = settings.VECTOR_DISTANCE_METRIC == "inner_product"
+        # Warm up on the inference executor so its thread's kernels and pools are initialized.
+        await loop.run_in_executor(
+            app.state.embed_executor,
+            model_manager.warm_up_embedding_model,
+            embedding_model,
+            normalize_embeddings,
+        )
+        app.state.embedding_batcher = EmbeddingBatcher(
+            app.state.embedding_model,
+            app.state.embed_executor,
+            max_batch_size=settings.EMBED_MAX_BATCH_SIZE,
+            max_wait_ms=settings.EMBED_BATCH_MAX_WAIT_MS,
+            semaphore=app.state.embed_sem,
+            normalize=normalize_embeddings,
+        )
+        app.state.embedding_batcher.start()
+
+        if reranker_result:
+            reranker_model = reranker_result[0]
+            if not isinstance(reranker_model, BaseException):
+                try:
+                    await loop.run_in_executor(
+                        app.state.rerank_executor,
+                        model_manager.warm_up_reranker_model,
+                        reranker_model,
+                        settings.RERANK_BATCH_SIZE,
+                    )
+                except Exception as e:
+                    reranker_model = e
+            if isinstance(reranker_model, BaseException):
                 app.state.reranker_model = None
-                logger.error(f"Failed to load reranker model: {e}", exc_info=True)
+                logger.error(f"Failed to load reranker model: {reranker_model}", exc_info=reranker_model)
+            else:
+                app.state.reranker_model = reranker_model
+                logger.info(f"Reranker model '{settings.RERANKER_MODEL_NAME}' loaded successfully.")
+                app.state.rerank_batcher = RerankBatcher(
+                    app.state.reranker_model,
+                    app.state.rerank_executor,
+                    max_batch_size=settings.RERANK_MAX_BATCH_SIZE,
+                    max_wait_ms=settings.RERANK_BATCH_MAX_WAIT_MS,
+                    semaphore=app.state.rerank_sem,
+                    forward_batch_size=settings.RERANK_BATCH_SIZE,
+                )
+                app.state.rerank_batcher.start()
     except Exception as e:
         app.state.embedding_model = None
         app.state.index_status = IndexStatus.NOT_FOUND
+        db_connect_task.cancel()
         logger.critical(f"CRITICAL: Failed to load sentence-transformer model: {e}", exc_info=True)
         raise
 
@@ -92,23 +173,15 @@ async def load_dependencies(app: FastAPI):
         app.state.db_table_name = db_table_name
         logger.info(f"Manifest loaded. Using database table: {db_table_name}")
 
-        logger.info("Creating PostgreSQL connection pool...")
-        app.state.db_engine = create_async_engine(
-            settings.DATABASE_URL, 
-            pool_size=10, 
-            max_overflow=5,
-            pool_recycle=1800 # Recycle connections every 30 mins
-        )
-        
-        async with app.state.db_engine.connect() as conn:
-            await conn.execute(text("SELECT 1"))
+        app.state.pg_pool = await db_connect_task
         
         logger.info("Database connection successful. Service is now fully operational.")
         app.state.index_status = IndexStatus.LOADED
-        app.state.index_last_modified = datetime.utcnow()
+        app.state.index_last_modified = datetime.now(timezone.utc)
 
     except Exception as e:
-        app.state.db_engine = None
+        db_connect_task.cancel()
+        app.state.pg_pool = None
         app.state.db_table_name = None
         app.state.index_status = IndexStatus.NOT_FOUND
         logger.error(f"Failed to initialize database connection from manifest: {e}", exc_info=True)
@@ -132,22 +205,54 @@ async def lifespan(app: FastAPI):
     logger.info(f"Starting Librarian Service v{settings.SERVICE_VERSION}")
     
     app.state.thread_pool = ThreadPoolExecutor(max_workers=settings.MAX_WORKERS)
+    # Inference gets its own executors so model calls never queue behind OCI/model-loading
+    # work, and run with a fixed, predictable degree of parallelism (one batch per thread).
+    app.state.embed_executor = ThreadPoolExecutor(
+        max_workers=settings.MAX_CONCURRENT_EMBED, thread_name_prefix="embed"
+    )
+    app.state.rerank_executor = ThreadPoolExecutor(
+        max_workers=settings.MAX_CONCURRENT_RERANK, thread_name_prefix="rerank"
+    )
+    app.state.embed_sem = asyncio.Semaphore(settings.MAX_CONCURRENT_EMBED)
+    app.state.rerank_sem = asyncio.Semaphore(settings.MAX_CONCURRENT_RERANK)
     app.state.index_status = IndexStatus.LOADING
     app.state.index_last_modified = None
     app.state.embedding_model = None
     app.state.reranker_model = None
-    app.state.db_engine = None
+    app.state.embedding_batcher = None
+    app.state.rerank_batcher = None
+    app.state.pg_pool = None
     app.state.db_table_name = None
     app.state.index_manifest = None
+    app.state.bg_tasks = set()
+    app.state.resource_usage = {"cpu_load_percent": 0.0, "memory_usage_percent": 0.0}
+    app.state.redis_status = None
+    app.state.redis_status_checked_at = 0.0
     
     try:
-        app.state.redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+        redis_pool = redis.BlockingConnectionPool.from_url(
+            settings.REDIS_URL,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=1,
+            socket_keepalive=True,
+            health_check_interval=30,
+            decode_responses=False,
+        )
+        # from_pool hands the pool to the client, so closing the client disconnects it.
+        app.state.redis_client = redis.Redis.from_pool(redis_pool)
         await app.state.redis_client.ping()
+        app.state.cache_get_or_reserve, app.state.cache_release_lease = await register_cache_scripts(
+            app.state.redis_client
+        )
         logger.info("Successfully connected to Redis.")
     except Exception as e:
         app.state.redis_client = None
         logger.error(f"Could not connect to Redis: {e}", exc_info=True)
 
+    resource_sampler = asyncio.create_task(
+        sample_resources_loop(app, settings.RESOURCE_SAMPLE_INTERVAL_SECONDS)
+    )
+
     startup_task = asyncio.create_task(timed_load_wrapper(app))
     startup_task.add_done_callback(_handle_startup_errors)
     
@@ -155,10 +260,19 @@ async def lifespan(app: FastAPI):
     yield
     
     logger.info("Shutting down Librarian Service.")
+    resource_sampler.cancel()
+    for batcher in (app.state.embedding_batcher, app.state.rerank_batcher):
+        if batcher:
+            await batcher.stop()
+    if app.state.bg_tasks:
+        # Let in-flight cache writes finish before the Redis client is closed.
+        await asyncio.gather(*app.state.bg_tasks, return_exceptions=True)
     if app.state.redis_client:
         await app.state.redis_client.close()
-    if app.state.db_engine:
-        await app.state.db_engine.dispose()
+    if app.state.pg_pool:
+        await app.state.pg_pool.close()
+    app.state.embed_executor.shutdown()
+    app.state.rerank_executor.shutdown()
     app.state.thread_pool.shutdown()
     logger.info("Shutdown complete.")
 
@@ -172,8 +286,7 @@ app = FastAPI(
     default_response_class=ORJSONResponse,
 )
 
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+app.add_exception_handler(StarletteHTTPException, orjson_http_exception_handler)
 app.include_router(api_router, prefix="/api/v1")
 
 @app.get("/", include_in_schema=False)
@@ -1,7 +1,7 @@
 # app\models\schemas.py
 
-from typing import List, Optional, Any
-from pydantic import BaseModel, Field, validator
+from typing import Annotated, List, Optional, Any
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints
 from datetime import datetime
 from enum import Enum
 
@@ -32,16 +32,14 @@ class HealthResponse(BaseModel):
     db_table_name: Optional[str] = Field(None, description="The name of the active PostgreSQL table.")
 
 class ContextRequest(BaseModel):
-    query: str = Field(..., min_length=3, max_length=512, description="The user query.")
+    model_config = ConfigDict(frozen=True)
+
+    # Only the query is stripped (in pydantic-core, before the length check), so
+    # whitespace-only queries fail min_length. Filter keys are matched verbatim.
+    query: Annotated[str, StringConstraints(strip_whitespace=True)] = Field(..., min_length=3, max_length=512, description="The user query.")
     max_results: int = Field(5, gt=0, le=20, description="Max number of results.")
     filters: Optional[dict[str, Any]] = Field(None, description="Key-value pairs to filter metadata. Example: {'language': 'python', 'is_test_file': false}")
 
-    @validator("query")
-    def query_must_not_be_empty(cls, v):
-        if not v.strip():
-            raise ValueError("Query cannot be empty or just whitespace")
-        return v
-
 class ContextChunk(BaseModel):
     content: str
     metadata: dict[str, Any]